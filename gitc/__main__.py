@@ -30,13 +30,19 @@ Examples:
 """
 from __future__ import annotations
 
-import dataclasses
 import datetime as dt
 import fnmatch
+import functools
+import hashlib
+import heapq
+import json
 import os
 import re
 import subprocess
-from typing import List, Optional, Tuple
+import sys
+import tempfile
+import time
+from typing import AnyStr, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
 
 import typer
 
@@ -48,61 +54,169 @@ app = typer.Typer(add_completion=False, no_args_is_help=True,
 # -------------------------
 
 SHORT_DATE_FMT = "%Y-%m-%d"
+_AGE_RE = re.compile(r"\s*(\d+)\s*([dwmy])\s*")
+_UNIT_DAYS = (1, 7, 30, 365)  # days per unit, indexed like "dwmy"
+SEARCH_CACHE_TTL = 60  # seconds a cached `gitc search` result stays valid
+DELETE_BATCH_SIZE = 100  # branches per `git branch -d`; keeps argv well under Windows' 32K limit
 
 def run(cmd: List[str], cwd: Optional[str] = None) -> Tuple[int, str, str]:
     """Run a command and return (returncode, stdout, stderr)."""
     p = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True)
     return p.returncode, p.stdout.strip(), p.stderr.strip()
 
-def ensure_git_repo() -> None:
-    rc, out, _ = run(["git", "rev-parse", "--is-inside-work-tree"])
-    if rc != 0 or out != "true":
+def run_stream(cmd: List[str], input: Optional[str] = None, binary: bool = False) -> Iterator[AnyStr]:
+    """Run a command, feeding it *input* on stdin, and yield stdout lines as they arrive.
+
+    Lines are bytes with *binary*, else str. Exits with the command's stderr if
+    it fails. stderr goes to a temp file, as a second pipe left unread while
+    stdout streams could fill up and deadlock.
+    """
+    newline = b"\n" if binary else "\n"
+    with tempfile.TemporaryFile() as errf:
+        p = subprocess.Popen(cmd, stdin=subprocess.PIPE if input is not None else None,
+                             stdout=subprocess.PIPE, stderr=errf,
+                             text=not binary, bufsize=-1 if binary else 1)
+        if input is not None:
+            try:
+                with p.stdin:
+                    p.stdin.write(input)
+            except BrokenPipeError:
+                pass  # exited without reading it all; reported via rc/stderr below
+        try:
+            for line in p.stdout:
+                yield line.rstrip(newline)
+        finally:
+            p.stdout.close()
+            rc = p.wait()
+        errf.seek(0)
+        err = errf.read().decode(errors="replace").strip()
+    if rc != 0:
+        typer.secho(err or f"{' '.join(cmd[:2])} failed", fg=typer.colors.RED, err=True)
+        raise typer.Exit(code=1)
+
+class _GitBatch:
+    """Persistent `git cat-file --batch-check` co-process for object lookups.
+
+    The process is started on the first lookup and torn down on exit, so many
+    lookups share one git start-up instead of paying for one each.
+    """
+
+    def __init__(self, fmt: str = "%(objectname) %(objecttype)") -> None:
+        self._cmd = ["git", "cat-file", f"--batch-check={fmt}"]
+        self._proc: Optional[subprocess.Popen] = None
+
+    def __enter__(self) -> "_GitBatch":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            pass
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+
+    def lookup(self, rev: str) -> Optional[str]:
+        """Return the batch-check line for *rev*, or None if it does not exist."""
+        if self._proc is None:
+            self._proc = subprocess.Popen(self._cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                          stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        self._proc.stdin.write(rev + "\n")
+        self._proc.stdin.flush()
+        line = self._proc.stdout.readline().rstrip("\n")
+        return None if not line or line.endswith(" missing") else line
+
+def ensure_git_repo(*rev_args: str) -> List[str]:
+    """Exit unless inside a work tree; return `git rev-parse` output for *rev_args*.
+
+    Extra arguments ride along on the same rev-parse call, saving a git process.
+    The returned list is empty if they could not be resolved.
+    """
+    rc, out, _ = run(["git", "rev-parse", "--is-inside-work-tree", *rev_args])
+    lines = out.splitlines()
+    if not lines or lines[0] != "true":
         typer.secho("Error: not inside a Git repository.", fg=typer.colors.RED, err=True)
         raise typer.Exit(code=2)
+    return lines[1:] if rc == 0 else []
 
 def now() -> dt.datetime:
     return dt.datetime.now(dt.timezone.utc)
 
+@functools.lru_cache(maxsize=256)
 def parse_age(expr: str) -> dt.timedelta:
     """Parse durations like 30d, 12w, 6m, 1y into timedelta."""
-    m = re.fullmatch(r"\s*(\d+)\s*([dwmy])\s*", expr.lower())
+    m = _AGE_RE.fullmatch(expr.lower())
     if not m:
         raise typer.BadParameter("Use formats like 30d, 12w, 6m, 1y")
     n = int(m.group(1))
     unit = m.group(2)
-    days = {"d": 1, "w": 7, "m": 30, "y": 365}[unit] * n
+    days = _UNIT_DAYS["dwmy".index(unit)] * n
     return dt.timedelta(days=days)
 
-def to_regex(pattern: str, is_regex: bool) -> re.Pattern:
+class _LiteralMatcher:
+    """Stand-in for a compiled pattern when every glob is a plain branch name.
+
+    `search` is a set lookup against the whole name.
+    """
+    __slots__ = ("names",)
+
+    def __init__(self, names: List[str]) -> None:
+        self.names = frozenset(names)
+
+    def search(self, name: str) -> bool:
+        return name in self.names
+
+@functools.lru_cache(maxsize=256)
+def to_regex(pattern: str, is_regex: bool) -> Union[re.Pattern, _LiteralMatcher]:
+    """Compile a regex, or comma-separated globs, into a matcher used via `search`.
+
+    Globs are anchored to the whole name, so a single `search` call gives glob
+    semantics; see `ref_matches` for remote refs.
+    """
     if is_regex:
         return re.compile(pattern)
     globs = [g.strip() for g in pattern.split(",") if g.strip()]
-    regex = "|".join(fnmatch.translate(g).rstrip("\\Z") for g in globs) or ".*"
-    return re.compile(regex)
+    if globs and not any(c in g for g in globs for c in "*?["):
+        return _LiteralMatcher(globs)
+    if not globs:
+        return re.compile(".*", re.ASCII)
+    regex = "|".join(fnmatch.translate(g).rstrip("\\Z") for g in globs)
+    return re.compile(rf"\A(?:{regex})\Z", re.ASCII)
 
-def pad(s: str, w: int) -> str:
-    s = s if s is not None else ""
-    return s[:w].ljust(w)
+# Default protected branches never touched by `stale`
+PROTECTED_BRANCHES = ("main", "master", "develop", "dev")
+_PROTECTED_RX = to_regex(",".join(PROTECTED_BRANCHES), False)
 
 def print_table(rows: List[List[str]], headers: List[str]) -> None:
-    cols = list(zip(*(headers, *rows))) if rows else [headers]
-    widths = [max(len(str(c)) for c in col) for col in cols]
-    line = "  ".join(pad(h, w) for h, w in zip(headers, widths))
-    typer.secho(line, bold=True)
+    widths = [len(h) for h in headers]
     for r in rows:
-        typer.echo("  ".join(pad(c, w) for c, w in zip(r, widths)))
+        for i, c in enumerate(r):
+            n = len(c)
+            if n > widths[i]:
+                widths[i] = n
+    line = "  ".join(h.ljust(w) for h, w in zip(headers, widths))
+    typer.secho(line, bold=True)
+    # One buffered write for the body; only the header needs click's styling.
+    sys.stdout.write("".join("  ".join(c.ljust(w) for c, w in zip(r, widths)) + "\n" for r in rows))
+    sys.stdout.flush()
 
 # -------------------------
 # Core data helpers
 # -------------------------
 
-@dataclasses.dataclass
-class RefInfo:
+class RefInfo(NamedTuple):
     name: str
     scope: str           # "local" or "remote"
     upstream: str
     commit_date: Optional[str]
     last_commit_ts: Optional[int]
+    sha: str             # object the ref points at
 
 def list_refs(include_locals: bool = True, include_remotes: bool = True) -> List[RefInfo]:
     ensure_git_repo()
@@ -113,26 +227,107 @@ def list_refs(include_locals: bool = True, include_remotes: bool = True) -> List
         ref_kinds.append("refs/remotes")
     if not ref_kinds:
         return []
-    fmt = "%(refname:short)|%(committerdate:iso-strict)|%(upstream:short)|%(authordate:unix)"
-    rc, out, err = run(["git", "for-each-ref", f"--format={fmt}", *ref_kinds])
-    if rc != 0:
-        typer.secho(err or "git for-each-ref failed", fg=typer.colors.RED, err=True)
-        raise typer.Exit(code=1)
+    # Fields are split on ASCII unit separators (%1f), which cannot occur in
+    # refnames; "|" can, and such branches used to be dropped.
+    fmt = "%(refname)%1f%(objectname)%1f%(refname:short)%1f%(committerdate:iso-strict)%1f%(upstream:short)%1f%(authordate:unix)"
+    # Stream the output so parsing overlaps git's ref enumeration. It is read as
+    # bytes and only the fields kept as text are decoded.
     rows = []
-    for line in out.splitlines():
-        parts = line.split("|")
-        if len(parts) != 4:
-            continue
-        refname, date_iso, upstream, ts = parts
-        scope = "remote" if refname.startswith(("origin/", "upstream/")) or refname.count("/") >= 2 else "local"
+    for line in run_stream(["git", "for-each-ref", "--sort=refname", f"--format={fmt}", *ref_kinds],
+                           binary=True):
+        fullname, _, rest = line.partition(b"\x1f")
+        sha, _, rest = rest.partition(b"\x1f")
+        refname, _, rest = rest.partition(b"\x1f")
+        date_iso, _, rest = rest.partition(b"\x1f")
+        upstream, sep, ts = rest.partition(b"\x1f")
+        if not sep:
+            continue  # malformed record
+        scope = "remote" if fullname.startswith(b"refs/remotes/") else "local"
         last_ts = int(ts) if ts.isdigit() else None
-        rows.append(RefInfo(refname, scope, upstream, date_iso, last_ts))
+        rows.append(RefInfo(os.fsdecode(refname), scope, os.fsdecode(upstream),
+                            date_iso.decode("ascii"), last_ts, sha.decode("ascii")))
     return rows
 
+def search_cache_path(key_parts: List[str]) -> str:
+    """Cache file for a search keyed by *key_parts* (command, repo, HEAD)."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    key = hashlib.sha256("\0".join(key_parts).encode("utf-8", "surrogateescape")).hexdigest()
+    return os.path.join(base, "gitc", "search", f"{key}.json")
+
+def load_search_cache(path: str) -> Optional[List[str]]:
+    """Return cached `git log` lines, or None if missing, expired or unreadable."""
+    try:
+        if time.time() - os.path.getmtime(path) > SEARCH_CACHE_TTL:
+            return None
+        with open(path, encoding="utf-8") as f:
+            lines = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(lines, list) or not all(isinstance(ln, str) for ln in lines):
+        return None
+    return lines
+
+def store_search_cache(path: str, lines: List[str]) -> None:
+    """Best-effort write of `git log` lines; a failed write only loses the cache.
+
+    Entries past SEARCH_CACHE_TTL can never be hit again, so they are pruned
+    here to keep the directory from growing.
+    """
+    cache_dir = os.path.dirname(path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(lines, f)
+        os.replace(tmp, path)
+    except (OSError, ValueError):
+        pass
+    cutoff = time.time() - SEARCH_CACHE_TTL
+    try:
+        with os.scandir(cache_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+                except OSError:
+                    pass  # raced with another gitc, or not ours to remove
+    except OSError:
+        pass
+
+def ref_matches(rx: Union[re.Pattern, _LiteralMatcher], r: RefInfo, is_regex: bool) -> bool:
+    """Match *r* against a `to_regex` matcher.
+
+    Globs also match a remote ref by its name after the remote, so `main`
+    finds `origin/main`; local names are only matched whole.
+    """
+    if rx.search(r.name):
+        return True
+    return not is_regex and r.scope == "remote" and bool(rx.search(r.name.partition("/")[2]))
+
 def resolve_branches(pattern: str, is_regex: bool, include_remotes: bool, include_locals: bool) -> List[RefInfo]:
     rx = to_regex(pattern, is_regex)
     refs = list_refs(include_locals=include_locals, include_remotes=include_remotes)
-    return [r for r in refs if rx.fullmatch(r.name) or rx.search(r.name)]
+    return [r for r in refs if ref_matches(rx, r, is_regex)]
+
+def walk_commits(graph: Dict[str, Tuple[int, List[str], str]], tip: str) -> Iterator[str]:
+    """Yield commits reachable from *tip* in `graph` in `git log`'s default order.
+
+    Like git: newest committer date first, ties in the order commits were
+    queued. Commits missing from the graph (cut off by --since) end the path.
+    """
+    if tip not in graph:
+        return
+    queue = [(-graph[tip][0], 0, tip)]
+    seen = {tip}
+    queued = 1
+    while queue:
+        _, _, sha = heapq.heappop(queue)
+        yield sha
+        for p in graph[sha][1]:
+            if p not in seen and p in graph:
+                seen.add(p)
+                heapq.heappush(queue, (-graph[p][0], queued, p))
+                queued += 1
 
 # -------------------------
 # Commands
@@ -149,7 +344,7 @@ def find_branch(pattern: str,
         typer.secho("No branches matched.", fg=typer.colors.YELLOW)
         raise typer.Exit()
     rows = [[r.name, r.scope, r.upstream or "-", r.commit_date or "-"]
-            for r in sorted(matches, key=lambda x: (x.scope, x.name.lower()))]
+            for r in sorted(matches, key=lambda x: x.scope)]  # stable: keeps git's refname order
     print_table(rows, headers=["BRANCH", "SCOPE", "UPSTREAM", "LAST_COMMIT"])
 
 @app.command("activity")
@@ -165,23 +360,50 @@ def activity(since: str = typer.Option(..., "--since"),
         typer.secho("No local branches matched.", fg=typer.colors.YELLOW)
         raise typer.Exit()
 
+    # One `git log` walk from every matched tip, fed on stdin so the command
+    # line stays short, loads the commit graph; each branch's listing is then
+    # replayed from it in Python.
+    tips = list(dict.fromkeys(r.sha for r in refs))
+    revs = "".join(f"{sha}\n" for sha in tips)
+    shown = None
+    if until or author:
+        # These only hide commits; the walk must still follow their parents,
+        # so the visible set comes from a second, filtered log.
+        fcmd = ["git", "log", "--stdin", f"--since={since}", "--format=%H"]
+        if until: fcmd.append(f"--until={until}")
+        if author: fcmd.append(f"--author={author}")
+        shown = set(run_stream(fcmd, revs))
+    cmd = ["git", "log", "--stdin", f"--since={since}", "--pretty=%ct %H %P%x1f%h|%ad|%s", "--date=short"]
+    graph: Dict[str, Tuple[int, List[str], str]] = {}
+    for line in run_stream(cmd, revs):
+        ids, _, ln = line.partition("\x1f")
+        ct, sha, *parents = ids.split()
+        graph[sha] = (int(ct), parents, ln)
+
+    by_branch: List[List[str]] = []
+    for r in refs:
+        lines = []
+        for sha in walk_commits(graph, r.sha):
+            if limit > 0 and len(lines) >= limit:
+                break
+            if shown is None or sha in shown:
+                lines.append(graph[sha][2])
+        by_branch.append(lines)
+
     total = 0
-    for r in sorted(refs, key=lambda x: x.name.lower()):
-        cmd = ["git", "log", r.name, f"--since={since}"]
-        if until: cmd.append(f"--until={until}")
-        cmd += ["--pretty=%h|%ad|%s", "--date=short"]
-        if author: cmd.append(f"--author={author}")
-        if limit > 0: cmd += [f"--max-count={limit}"]
-        rc, out, err = run(cmd)
-        if rc != 0: continue
-        lines = [ln for ln in out.splitlines() if ln.strip()]
+    for r, lines in zip(refs, by_branch):  # refs are in refname order from list_refs
         if not lines: continue
         typer.secho(f"\n[{r.name}] — {len(lines)} commit(s)", bold=True)
         total += len(lines)
+        out_lines = []
         for ln in lines:
-            try: h, d, s = ln.split("|", 2)
-            except ValueError: h, d, s = ln, "", ""
-            typer.echo(f"  {pad(h,8)}  {pad(d,10)}  {s}")
+            parts = ln.split("|", 2)
+            h = parts[0]
+            d = parts[1] if len(parts) > 1 else ""
+            s = parts[2] if len(parts) > 2 else ""
+            out_lines.append(f"  {h.ljust(8)}  {d.ljust(10)}  {s}\n")
+        sys.stdout.write("".join(out_lines))
+        sys.stdout.flush()
     if total == 0:
         typer.secho("\nNo activity found.", fg=typer.colors.YELLOW)
     else:
@@ -190,32 +412,34 @@ def activity(since: str = typer.Option(..., "--since"),
 @app.command("stale")
 def stale_branches(age: str,  # positional now
                    include_remotes: bool = typer.Option(False, "--remotes"),
-                   keep: str = typer.Option("", "--keep", help="Comma-separated branches to preserve in addition to protected ones"),
+                   keep: str = typer.Option("", "--keep", help="Comma-separated branch names or globs to preserve in addition to "
+                                             "protected ones (main, master, develop, dev). Matches whole names: "
+                                             "use e.g. 'dev*' to also keep dev-tools. With --regex, a regex searched anywhere"),
                    regex: bool = typer.Option(False, "--regex"),
                    delete: bool = typer.Option(False, "--delete"),
                    force: bool = typer.Option(False, "--force")):
     """List candidate stale branches. Optionally delete local stale branches."""
-    ensure_git_repo()
-    cutoff = now() - parse_age(age)
-    rc, cur, _ = run(["git", "rev-parse", "--abbrev-ref", "HEAD"])
-    current_branch = cur if rc == 0 else None
+    head = ensure_git_repo("--abbrev-ref", "HEAD")
+    cutoff_ts = int((now() - parse_age(age)).timestamp())
+    current_branch = head[0] if head else None
 
     refs = list_refs(True, include_remotes)
 
-    # Default protected branches never touched
-    protected = ["main", "master", "develop", "dev"]
-    keep_rx = to_regex(",".join(protected + [b.strip() for b in keep.split(",") if b.strip()]), regex)
+    # Only build a matcher if --keep names something; an empty glob list
+    # would compile to ".*" and keep every branch.
+    has_keep = keep.strip() if regex else any(g.strip() for g in keep.split(","))
+    keep_rx = to_regex(keep, regex) if has_keep else None
 
     stale_rows, victims = [], []
     for r in refs:
-        if keep_rx and (keep_rx.fullmatch(r.name) or keep_rx.search(r.name)):
+        if ref_matches(_PROTECTED_RX, r, False) or (keep_rx and ref_matches(keep_rx, r, regex)):
             continue  # skip protected / explicitly kept branches
         if r.name == current_branch:
             continue
         if r.last_commit_ts is None:
             continue
-        last_dt = dt.datetime.fromtimestamp(r.last_commit_ts, dt.timezone.utc)
-        if last_dt <= cutoff:
+        if r.last_commit_ts <= cutoff_ts:
+            last_dt = dt.datetime.fromtimestamp(r.last_commit_ts, dt.timezone.utc)
             stale_rows.append([r.name, r.scope, (r.upstream or "-"), last_dt.strftime(SHORT_DATE_FMT)])
             if r.scope == "local":
                 victims.append(r.name)
@@ -228,9 +452,22 @@ def stale_branches(age: str,  # positional now
 
     if delete and victims:
         typer.secho("\nDeleting local stale branches...", bold=True)
+        flag = "-D" if force else "-d"
+        failed = []  # branches in batches git reported errors for
+        for i in range(0, len(victims), DELETE_BATCH_SIZE):
+            batch_names = victims[i:i + DELETE_BATCH_SIZE]
+            rc, _, _ = run(["git", "branch", flag, *batch_names])
+            if rc != 0:
+                failed += batch_names
+        remaining = set()
+        if failed:  # git deletes what it can; find the survivors
+            with _GitBatch() as batch:
+                remaining = {v for v in failed if batch.lookup(f"refs/heads/{v}") is not None}
         for v in victims:
-            cmd = ["git", "branch", "-D" if force else "-d", v]
-            rc, out, err = run(cmd)
+            if v not in remaining:
+                typer.echo(f"  deleted: {v}")
+                continue
+            rc, out, err = run(["git", "branch", flag, v])  # retry alone for its own error
             typer.echo(f"  deleted: {v}" if rc == 0 else f"  failed: {v} — {err or out}")
 
 @app.command("search")
@@ -243,7 +480,8 @@ def search_commits(query: str,
                    pick: Optional[int] = typer.Option(None, "--pick"),
                    show: int = typer.Option(20, "--show")):
     """Search commits by message and optionally cherry-pick one."""
-    ensure_git_repo()
+    # With --all every ref's sha joins the cache key, on the same rev-parse call.
+    head = ensure_git_repo("--show-toplevel", "HEAD", *(["--all"] if all else []))
     cmd = ["git", "log"]
     if all: cmd.append("--all")
     cmd += ["--pretty=%h|%ad|%s", "--date=short", f"--grep={query}"]
@@ -252,18 +490,23 @@ def search_commits(query: str,
     if since: cmd.append(f"--since={since}")
     if until: cmd.append(f"--until={until}")
     if show > 0: cmd.append(f"--max-count={show}")
-    rc, out, err = run(cmd)
-    if rc != 0:
-        typer.secho(err or "git log failed", fg=typer.colors.RED, err=True)
-        raise typer.Exit(code=1)
-    lines = [ln for ln in out.splitlines() if ln.strip()]
+    # Re-running the same search (e.g. list, then --pick) is served from a
+    # short-lived cache; moving HEAD (or, with --all, any ref) changes the key.
+    cache_path = search_cache_path([*cmd, *head]) if head else None
+    lines = load_search_cache(cache_path) if cache_path else None
+    if lines is None:
+        lines = [ln for ln in run_stream(cmd) if ln.strip()]
+        if cache_path:
+            store_search_cache(cache_path, lines)
     if not lines:
         typer.secho("No matching commits.", fg=typer.colors.YELLOW)
         raise typer.Exit()
     hashes, rows = [], []
     for idx, ln in enumerate(lines, start=1):
-        try: h, d, s = ln.split("|", 2)
-        except ValueError: h, d, s = ln, "", ""
+        parts = ln.split("|", 2)
+        h = parts[0]
+        d = parts[1] if len(parts) > 1 else ""
+        s = parts[2] if len(parts) > 2 else ""
         hashes.append(h)
         rows.append([str(idx), h, d, s])
     print_table(rows, headers=["#", "HASH", "DATE", "MESSAGE"])